@@ -1,27 +1,37 @@
 from fastmcp import FastMCP
 from pydantic import BaseModel
-from typing import Dict, Any, List
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from typing import Any, Literal
 
 app = FastMCP()
 
+# Empty report skeleton, copied per call and never mutated in place
+_ATT_REPORT_TEMPLATE = {
+    "total_players": 0,
+    "present_count": 0,
+    "absent_count": 0,
+    "late_count": 0,
+}
+
 
 # Placeholder models for tool inputs/outputs
 class AttendanceRecord(BaseModel):
     player_id: str
     event_id: str
-    status: str  # present, absent, late
+    status: Literal["present", "absent", "late"]
     timestamp: str
     team_id: str
 
 
 class AttendanceAnalysisRequest(BaseModel):
     team_id: str
-    date_range: str = None
-    player_ids: List[str] = None
+    date_range: str | None = None
+    player_ids: list[str] | None = None
 
 
 @app.tool()
-async def record_attendance(record: AttendanceRecord) -> Dict[str, Any]:
+async def record_attendance(record: AttendanceRecord) -> dict[str, Any]:
     """
     Record attendance for a player at a specific event.
     """
@@ -39,7 +49,7 @@ async def record_attendance(record: AttendanceRecord) -> Dict[str, Any]:
 @app.tool()
 async def analyze_attendance_patterns(
     data: AttendanceAnalysisRequest,
-) -> Dict[str, Any]:
+) -> dict[str, Any]:
     """
     Analyze attendance patterns for a team or specific players.
     """
@@ -58,7 +68,7 @@ async def analyze_attendance_patterns(
 
 
 @app.tool()
-async def get_attendance_report(team_id: str, event_id: str = None) -> Dict[str, Any]:
+async def get_attendance_report(team_id: str, event_id: str | None = None) -> dict[str, Any]:
     """
     Generate attendance report for a team or specific event.
     """
@@ -68,22 +78,31 @@ async def get_attendance_report(team_id: str, event_id: str = None) -> Dict[str,
         "message": "Attendance report generated",
         "team_id": team_id,
         "event_id": event_id,
-        "report_data": {
-            "total_players": 0,
-            "present_count": 0,
-            "absent_count": 0,
-            "late_count": 0,
-        },
+        "report_data": _ATT_REPORT_TEMPLATE.copy(),
     }
 
 
-@app.get("/health")
-async def health_check():
+@app.custom_route("/health", methods=["GET"])
+async def health_check(request: Request) -> JSONResponse:
     """Health check endpoint for Docker health checks."""
-    return {"status": "healthy", "service": "attendance-agent"}
+    return JSONResponse({"status": "healthy", "service": "attendance-agent"})
+
+
+# ASGI app exposed at module level so uvicorn workers can import it.
+# Stateless, so a request can land on any worker without a pinned session.
+asgi_app = app.http_app(stateless_http=True)
 
 
 if __name__ == "__main__":
+    import os
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(
+        "main:asgi_app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.getenv("WEB_CONCURRENCY", "4")),
+        loop="uvloop",
+        http="httptools",
+        log_level="warning",
+    )
@@ -1,35 +1,119 @@
 from fastmcp import FastMCP
-from pydantic import BaseModel
-from typing import Dict, Any, List
-import base64
+from pydantic import BaseModel, ConfigDict, ValidationError
+from starlette.requests import Request
+from starlette.responses import Response
+from typing import Any, Literal
+import asyncio
 import logging
-import json
+import os
 import httpx
-from datetime import datetime
+import orjson
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    retry_if_result,
+    stop_after_attempt,
+    wait_random_exponential,
+)
 
 # Configure logging
 logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    level=os.getenv("LOG_LEVEL", "WARNING"), format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 )
 logger = logging.getLogger(__name__)
 
+# Fixed analysis metadata included in every response
+_ANALYSIS_METHOD = "llm_vision"
+_ANALYSIS_CONFIDENCE = 0.95
+
+# Shared HTTP client so calls to Laravel reuse pooled keep-alive connections
+_client = httpx.AsyncClient(
+    timeout=httpx.Timeout(connect=2.0, read=25.0, write=5.0, pool=1.0),
+    limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+    headers={"Content-Type": "application/json", "Accept": "application/json"},
+)
+
+
+# Retry only failures where the request was never processed: connect-phase errors
+# and 503 Service Unavailable. The POSTs here create events and are not idempotent,
+# so read timeouts, 502 and 504 (the upstream may already have run) are not retried.
+_RETRYABLE_STATUS_CODE = 503
+
+_retry_transient = retry(
+    stop=stop_after_attempt(3),
+    wait=wait_random_exponential(multiplier=0.1, max=2.0),
+    retry=(
+        retry_if_exception_type((httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+        | retry_if_result(lambda response: response.status_code == _RETRYABLE_STATUS_CODE)
+    ),
+    # Once attempts run out, hand back the last response or raise the last error
+    retry_error_callback=lambda retry_state: retry_state.outcome.result(),
+)
+
+
+@_retry_transient
+async def _post_json(url: str, obj: Any) -> httpx.Response:
+    """POST obj to url as JSON encoded with orjson."""
+    return await _client.post(url, content=orjson.dumps(obj), headers={"Content-Type": "application/json"})
+
+
+# Last computed timestamp, reused for calls within the same millisecond
+_now_iso_cache = [0.0, ""]
+
+
+def _now_iso() -> str:
+    """Return the current UTC time as an ISO 8601 string."""
+    now = time.time()
+    if now - _now_iso_cache[0] > 0.001:
+        _now_iso_cache[0] = now
+        _now_iso_cache[1] = datetime.fromtimestamp(now, tz=timezone.utc).isoformat()
+    return _now_iso_cache[1]
+
+
 # Create FastMCP app
 app = FastMCP()
 
 
 # Models for tool inputs/outputs
 class ScheduleImageAnalysisRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore", revalidate_instances="never")
+
     team_id: int
-    file_content: str  # base64 encoded file content
+    file_url: str  # signed URL to the stored upload, valid for a few minutes
     file_name: str
     file_size: int
     mime_type: str
     uploaded_at: str
+    create: bool = False
+
+
+class EventIn(BaseModel):
+    # Extra keys, such as the per-event team_id older callers send, are ignored;
+    # the team always comes from EventCreationRequest.team_id
+    model_config = ConfigDict(frozen=True)
+
+    title: str
+    date: str
+    time: str
+    location: str
+    type: Literal["practice", "game"] = "practice"
+    opponent: str | None = None
+    description: str = ""
+
+
+class ParsedEventIn(EventIn):
+    # LLM output has no legacy callers, so unexpected keys are reported, not dropped
+    model_config = ConfigDict(frozen=True, extra="forbid")
 
 
 class EventCreationRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore", revalidate_instances="never")
+
     team_id: int
-    events: List[Dict[str, Any]]
+    events: list[EventIn]
 
 
 class ScheduleEvent(BaseModel):
@@ -39,49 +123,69 @@ class ScheduleEvent(BaseModel):
     time: str
     location: str
     team_id: str
-    type: str = "practice"
-    opponent: str = None
+    type: Literal["practice", "game"] = "practice"
+    opponent: str | None = None
 
 
 @app.tool()
-async def analyze_schedule_image(data: ScheduleImageAnalysisRequest) -> Dict[str, Any]:
+async def analyze_schedule_image(data: ScheduleImageAnalysisRequest) -> dict[str, Any]:
     """
     Analyze schedule image using LLM to extract structured events.
     
     This tool:
-    1. Decodes the base64 image
-    2. Sends image to LLM with schedule extraction prompt
+    1. Receives a signed URL to the uploaded image
+    2. Passes the URL to the LLM with schedule extraction prompt
     3. Parses LLM response into structured events
-    4. Returns events ready for database creation
+    4. Optionally creates the events in Laravel in the same request
+    5. Returns events and any creation results
+    """
+    return await _analyze_schedule_image(data)
+
+
+@app.custom_route("/tools/analyze_schedule_image", methods=["POST"])
+async def analyze_schedule_image_http(request: Request) -> Response:
+    """
+    Plain HTTP entry point for analyze_schedule_image, used by the Team Captain.
     """
     try:
-        logger.info(f"Starting schedule image analysis for team {data.team_id}")
-        logger.info(f"File: {data.file_name}, Size: {data.file_size}, Type: {data.mime_type}")
+        data = ScheduleImageAnalysisRequest.model_validate_json(await request.body())
+    except ValidationError as e:
+        return Response(
+            orjson.dumps({"success": False, "message": "Invalid analysis request", "error": str(e)}),
+            status_code=422,
+            media_type="application/json",
+        )
 
-        # Decode the base64 file content
-        try:
-            file_content = base64.b64decode(data.file_content)
-            logger.info(f"Successfully decoded file content, size: {len(file_content)} bytes")
-        except Exception as e:
-            logger.error(f"Failed to decode base64 content: {e}")
-            return {
-                "success": False,
-                "message": "Failed to decode uploaded file",
-                "error": str(e),
-            }
+    result = await _analyze_schedule_image(data)
+    return Response(orjson.dumps(result), media_type="application/json")
+
+
+async def _analyze_schedule_image(data: ScheduleImageAnalysisRequest) -> dict[str, Any]:
+    """
+    Analyze the image behind data.file_url and optionally create its events.
+    """
+    try:
+        logger.info("Starting schedule image analysis for team %s", data.team_id)
+        logger.debug("File: %s, Size: %s, Type: %s", data.file_name, data.file_size, data.mime_type)
 
         # TODO: Implement actual LLM analysis
         # For now, we'll return mock events that match your Event model structure
-        logger.info(f"Analyzing schedule image for team {data.team_id}")
+        logger.debug("Analyzing schedule image for team %s", data.team_id)
         
         # Call LLM analysis (placeholder)
-        analysis_results = await call_llm_for_schedule_analysis(file_content, data.mime_type)
+        analysis_results = await call_llm_for_schedule_analysis(data.file_url, data.mime_type)
         
         if not analysis_results.get("success", False):
             return analysis_results
 
         events = analysis_results.get("events", [])
-        logger.info(f"LLM analysis found {len(events)} events")
+        logger.info("LLM analysis found %d events", len(events))
+
+        # Create events in-process rather than making the caller send them back
+        if data.create and events:
+            event_creation = await _create_parsed_events(data.team_id, events)
+        else:
+            event_creation = {"success": True, "events_created": 0}
 
         return {
             "success": True,
@@ -90,12 +194,13 @@ async def analyze_schedule_image(data: ScheduleImageAnalysisRequest) -> Dict[str
             "total_events": len(events),
             "team_id": data.team_id,
             "file_processed": data.file_name,
-            "processed_at": datetime.now().isoformat(),
-            "analysis_method": "llm_vision"
+            "processed_at": _now_iso(),
+            "analysis_method": _ANALYSIS_METHOD,
+            "event_creation": event_creation
         }
 
     except Exception as e:
-        logger.error(f"Error analyzing schedule image: {e}", exc_info=True)
+        logger.error("Error analyzing schedule image: %s", e, exc_info=True)
         return {
             "success": False,
             "message": "Failed to analyze schedule image",
@@ -104,15 +209,19 @@ async def analyze_schedule_image(data: ScheduleImageAnalysisRequest) -> Dict[str
         }
 
 
-async def call_llm_for_schedule_analysis(file_content: bytes, mime_type: str) -> Dict[str, Any]:
+async def call_llm_for_schedule_analysis(file_url: str, mime_type: str) -> dict[str, Any]:
     """
     Call LLM to analyze schedule image and extract events.
+
+    The image is passed by URL so the vision API fetches it directly and the
+    bytes never pass through this agent.
     """
     try:
-        # TODO: Replace with actual LLM API call (OpenAI, Anthropic, etc.)
+        # TODO: Replace with actual LLM API call (OpenAI, Anthropic, etc.),
+        # sending the image as {"type": "image_url", "image_url": {"url": file_url}}
         # For now, return mock structured events
         
-        logger.info("Calling LLM for schedule analysis (mock implementation)")
+        logger.debug("Calling LLM for schedule analysis (mock implementation)")
         
         # Mock events that match Laravel Event model structure
         mock_events = [
@@ -145,11 +254,11 @@ async def call_llm_for_schedule_analysis(file_content: bytes, mime_type: str) ->
         return {
             "success": True,
             "events": mock_events,
-            "analysis_confidence": 0.95
+            "analysis_confidence": _ANALYSIS_CONFIDENCE
         }
         
     except Exception as e:
-        logger.error(f"Error in LLM analysis: {e}")
+        logger.error("Error in LLM analysis: %s", e)
         return {
             "success": False,
             "error": str(e)
@@ -157,47 +266,88 @@ async def call_llm_for_schedule_analysis(file_content: bytes, mime_type: str) ->
 
 
 @app.tool()
-async def create_events(data: EventCreationRequest) -> Dict[str, Any]:
+async def create_events(data: EventCreationRequest) -> dict[str, Any]:
     """
     Create events in Laravel database via HTTP API.
     
     This tool:
     1. Receives structured events from Team Captain
-    2. Makes HTTP calls to Laravel to create each event
+    2. Makes a single bulk HTTP call to Laravel to create all events
     3. Returns creation results and statistics
     """
+    return await _create_events(data)
+
+
+async def _create_parsed_events(team_id: int, events: list[dict[str, Any]]) -> dict[str, Any]:
+    """
+    Validate LLM-parsed events one by one and create the valid ones.
+
+    Events that fail validation are reported in failed_events instead of
+    failing the whole analysis.
+    """
+    valid_events = []
+    invalid_events = []
+
+    for event_data in events:
+        try:
+            valid_events.append(ParsedEventIn.model_validate(event_data))
+        except ValidationError as e:
+            logger.error("Rejected parsed event: %s", e)
+            invalid_events.append({"event_data": event_data, "error": str(e)})
+
+    return await _create_events(
+        EventCreationRequest(team_id=team_id, events=valid_events),
+        failed_events=invalid_events,
+    )
+
+
+async def _create_events(
+    data: EventCreationRequest, failed_events: list[dict[str, Any]] | None = None
+) -> dict[str, Any]:
+    """
+    Create events through the Laravel bulk endpoint and summarize the results.
+
+    failed_events seeds the failure list, e.g. with events rejected before the call.
+    """
     try:
-        logger.info(f"Creating {len(data.events)} events for team {data.team_id}")
+        logger.debug("Creating %d events for team %s", len(data.events), data.team_id)
         
         created_events = []
-        failed_events = []
-        
-        for event_data in data.events:
-            try:
-                # Add team_id to event data
-                event_data['team_id'] = data.team_id
-                
-                # Call Laravel API to create event
-                result = await call_laravel_create_event(event_data)
-                
-                if result.get("success", False):
-                    created_events.append(result.get("event"))
-                    logger.info(f"Successfully created event: {event_data.get('title', 'Unknown')}")
+        failed_events = list(failed_events or [])
+
+        # Only fields the caller provided are sent, so Laravel applies its own defaults.
+        # team_id travels in the bulk URL, so it is not repeated in every event body.
+        event_payloads = [event.model_dump(exclude_unset=True) for event in data.events]
+
+        # Create every event with a single bulk request to Laravel
+        if event_payloads:
+            result = await call_laravel_bulk_create_events(data.team_id, event_payloads)
+        else:
+            result = {"success": True, "results": []}
+
+        if result.get("success", False):
+            rows = result.get("results", [])
+            for index, (event, event_data) in enumerate(zip(data.events, event_payloads)):
+                row = rows[index] if index < len(rows) else {"error": "No result returned by Laravel"}
+                if row.get("success", False):
+                    created_events.append(row.get("event"))
+                    logger.debug("Successfully created event: %s", event.title)
                 else:
                     failed_events.append({
                         "event_data": event_data,
-                        "error": result.get("error", "Unknown error")
+                        "error": row.get("error", "Unknown error")
                     })
-                    logger.error(f"Failed to create event: {event_data.get('title', 'Unknown')} - {result.get('error')}")
-                    
-            except Exception as e:
-                logger.error(f"Exception creating event {event_data.get('title', 'Unknown')}: {e}")
-                failed_events.append({
-                    "event_data": event_data,
-                    "error": str(e)
-                })
+                    logger.error("Failed to create event: %s - %s", event.title, row.get("error"))
+        else:
+            failed_events.extend(
+                {"event_data": event_data, "error": result.get("error", "Unknown error")}
+                for event_data in event_payloads
+            )
 
-        logger.info(f"Event creation completed: {len(created_events)} created, {len(failed_events)} failed")
+        logger.info(
+            "Event creation completed for team %s: %d created, %d failed",
+            data.team_id, len(created_events), len(failed_events),
+        )
 
         return {
             "success": True,
@@ -207,11 +357,11 @@ async def create_events(data: EventCreationRequest) -> Dict[str, Any]:
             "created_events": created_events,
             "failed_events": failed_events,
             "team_id": data.team_id,
-            "processed_at": datetime.now().isoformat()
+            "processed_at": _now_iso()
         }
 
     except Exception as e:
-        logger.error(f"Error in create_events: {e}", exc_info=True)
+        logger.error("Error in create_events: %s", e, exc_info=True)
         return {
             "success": False,
             "message": f"Failed to create events: {str(e)}",
@@ -219,48 +369,102 @@ async def create_events(data: EventCreationRequest) -> Dict[str, Any]:
         }
 
 
-async def call_laravel_create_event(event_data: Dict[str, Any]) -> Dict[str, Any]:
+async def call_laravel_bulk_create_events(team_id: int, events: list[dict[str, Any]]) -> dict[str, Any]:
     """
-    Call Laravel API to create a single event in the database.
+    Call Laravel API to create a batch of events in one request.
+
+    Laravel answers with one {success, event, error} entry per submitted event,
+    in the same order.
     """
     try:
         # Laravel backend URL (inside Docker network)
         laravel_url = "http://laravel:8000"
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{laravel_url}/api/teams/{event_data['team_id']}/events",
-                json=event_data,
-                headers={
-                    "Content-Type": "application/json",
-                    "Accept": "application/json"
+        response = await _post_json(
+            f"{laravel_url}/api/teams/{team_id}/events/bulk",
+            {"events": events},
+        )
+
+        if 200 <= response.status_code < 300:
+            if not response.content:
+                # An empty 2xx (e.g. 204) accepts the whole batch without per-event details
+                logger.debug("Bulk event creation accepted with an empty response via Laravel API")
+                return {
+                    "success": True,
+                    "results": [{"success": True, "event": None} for _ in events]
                 }
-            )
-            
-        if response.status_code in [200, 201]:
-            result = response.json()
-            logger.info(f"Successfully created event via Laravel API")
+            results = orjson.loads(response.content)
+            if not isinstance(results, list) or not all(isinstance(row, dict) for row in results):
+                logger.error("Unexpected bulk response shape from Laravel API: %s", response.text)
+                return {
+                    "success": False,
+                    "error": "Unexpected bulk response from Laravel: expected a list of per-event results"
+                }
+            logger.debug("Bulk event creation returned %d results via Laravel API", len(results))
             return {
                 "success": True,
-                "event": result
+                "results": results
             }
         else:
-            logger.error(f"Laravel API call failed: {response.status_code} - {response.text}")
+            logger.error("Laravel API call failed: %s - %s", response.status_code, response.text)
             return {
                 "success": False,
                 "error": f"HTTP {response.status_code}: {response.text}"
             }
             
     except Exception as e:
-        logger.error(f"Error calling Laravel API: {e}")
+        logger.error("Error calling Laravel API: %s", e)
         return {
             "success": False,
             "error": str(e)
         }
 
 
+def _build_asgi_app():
+    """
+    Build the HTTP app, closing the shared client once when the server shuts down.
+    """
+    # Stateless, so a request can land on any uvicorn worker without a pinned session
+    http_app = app.http_app(stateless_http=True)
+    mcp_lifespan = http_app.router.lifespan_context
+
+    @asynccontextmanager
+    async def lifespan(asgi):
+        try:
+            async with mcp_lifespan(asgi) as state:
+                yield state
+        finally:
+            await _client.aclose()
+
+    http_app.router.lifespan_context = lifespan
+    return http_app
+
+
+async def _run_stdio() -> None:
+    """Serve over stdio, closing the shared client when the server exits."""
+    try:
+        await app.run_stdio_async()
+    finally:
+        await _client.aclose()
+
+
+# ASGI app exposed at module level so uvicorn workers can import it
+asgi_app = _build_asgi_app()
 
 
 if __name__ == "__main__":
     logger.info("Starting Huddle-Up Schedule Agent...")
-    app.run()
+    if os.getenv("RUN_HTTP", "false").lower() == "true":
+        import uvicorn
+
+        uvicorn.run(
+            "main:asgi_app",
+            host="0.0.0.0",
+            port=8000,
+            workers=int(os.getenv("WEB_CONCURRENCY", "4")),
+            loop="uvloop",
+            http="httptools",
+            log_level="warning",
+        )
+    else:
+        asyncio.run(_run_stdio())
@@ -1,20 +1,66 @@
 from fastmcp import FastMCP
-from pydantic import BaseModel
-from typing import Dict, Any, List, Optional
+from pydantic import BaseModel, ConfigDict
+from typing import Any
+import asyncio
 import httpx
 import logging
+import orjson
+import os
+from contextlib import asynccontextmanager
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    retry_if_result,
+    stop_after_attempt,
+    wait_random_exponential,
+)
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"))
 logger = logging.getLogger(__name__)
 
+# Shared HTTP client so calls to the Schedule Agent reuse keep-alive connections
+_client = httpx.AsyncClient(
+    timeout=httpx.Timeout(connect=2.0, read=60.0, write=10.0, pool=1.0),
+    limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+    headers={"Accept": "application/json"},
+)
+
+# Retry only failures where the request was never processed: connect-phase errors
+# and 503 Service Unavailable. The POSTs here create events and are not idempotent,
+# so read timeouts, 502 and 504 (the upstream may already have run) are not retried.
+_RETRYABLE_STATUS_CODE = 503
+
+_retry_transient = retry(
+    stop=stop_after_attempt(3),
+    wait=wait_random_exponential(multiplier=0.1, max=2.0),
+    retry=(
+        retry_if_exception_type((httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+        | retry_if_result(lambda response: response.status_code == _RETRYABLE_STATUS_CODE)
+    ),
+    # Once attempts run out, hand back the last response or raise the last error
+    retry_error_callback=lambda retry_state: retry_state.outcome.result(),
+)
+
+
+@_retry_transient
+async def _post_json(url: str, obj: Any) -> httpx.Response:
+    """POST obj to url as JSON encoded with orjson."""
+    return await _client.post(url, content=orjson.dumps(obj), headers={"Content-Type": "application/json"})
+
+
 app = FastMCP()
 
+# Read-only fallback when the Schedule Agent reports no event creation
+_NO_EVENTS_CREATED = {"success": True, "events_created": 0}
+
 
 # Models for tool inputs/outputs
 class SchedulePhotoData(BaseModel):
+    model_config = ConfigDict(extra="ignore", revalidate_instances="never")
+
     team_id: int
-    file_content: str  # base64 encoded
+    file_url: str  # signed URL to the stored upload, valid for a few minutes
     file_name: str
     file_size: int
     mime_type: str
@@ -28,35 +74,35 @@ class ScheduleData(BaseModel):
 
 class ReminderData(BaseModel):
     message: str
-    recipients: List[str]
+    recipients: list[str]
     team_id: str
 
 
 class AttendanceData(BaseModel):
-    attendance_records: List[Dict[str, Any]]
+    attendance_records: list[dict[str, Any]]
     team_id: str
 
 
 @app.tool()
-async def process_schedule_photo(data: SchedulePhotoData) -> Dict[str, Any]:
+async def process_schedule_photo(data: SchedulePhotoData) -> dict[str, Any]:
     """
     Process uploaded schedule photo. Main orchestrator tool called by Laravel.
     
     This tool:
     1. Receives photo from Laravel
-    2. Delegates to Schedule Agent for AI analysis
-    3. Coordinates event creation back to Laravel
+    2. Delegates to Schedule Agent for AI analysis and event creation
+    3. Reports event creation back to Laravel
     4. Returns structured results
     """
     try:
-        logger.info(f"Processing schedule photo for team {data.team_id}")
-        logger.info(f"File: {data.file_name}, Size: {data.file_size}, Type: {data.mime_type}")
+        logger.info("Processing schedule photo for team %s", data.team_id)
+        logger.debug("File: %s, Size: %s, Type: %s", data.file_name, data.file_size, data.mime_type)
 
-        # Step 1: Call Schedule Agent to analyze the image
+        # Step 1: Call Schedule Agent to analyze the image and create the events it finds
         schedule_analysis = await call_schedule_agent_analyze_image(data)
         
         if not schedule_analysis.get("success", False):
-            logger.error(f"Schedule analysis failed: {schedule_analysis}")
+            logger.error("Schedule analysis failed: %s", schedule_analysis)
             return {
                 "success": False,
                 "message": "Failed to analyze schedule image",
@@ -65,26 +111,20 @@ async def process_schedule_photo(data: SchedulePhotoData) -> Dict[str, Any]:
             }
 
         events = schedule_analysis.get("events", [])
-        logger.info(f"Schedule analysis found {len(events)} events")
+        logger.info("Schedule analysis found %d events", len(events))
 
-        # Step 2: Call Schedule Agent to create events in Laravel database
-        if events:
-            event_creation = await call_schedule_agent_create_events({
-                "team_id": data.team_id,
-                "events": events
-            })
-            
-            if not event_creation.get("success", False):
-                logger.error(f"Event creation failed: {event_creation}")
-                return {
-                    "success": False,
-                    "message": "Failed to create events from schedule",
-                    "error": event_creation.get("error", "Unknown error"),
-                    "parsed_events": events,
-                    "team_id": data.team_id
-                }
-        else:
-            event_creation = {"success": True, "events_created": 0}
+        # Step 2: Check the event creation done by Schedule Agent in the same call
+        event_creation = schedule_analysis.get("event_creation", _NO_EVENTS_CREATED)
+
+        if not event_creation.get("success", False):
+            logger.error("Event creation failed: %s", event_creation)
+            return {
+                "success": False,
+                "message": "Failed to create events from schedule",
+                "error": event_creation.get("error", event_creation.get("message", "Unknown error")),
+                "parsed_events": events,
+                "team_id": data.team_id
+            }
 
         # Step 3: Return comprehensive results
         return {
@@ -102,7 +142,7 @@ async def process_schedule_photo(data: SchedulePhotoData) -> Dict[str, Any]:
         }
 
     except Exception as e:
-        logger.error(f"Error in process_schedule_photo: {str(e)}", exc_info=True)
+        logger.error("Error in process_schedule_photo: %s", e, exc_info=True)
         return {
             "success": False,
             "message": f"Failed to process schedule photo: {str(e)}",
@@ -110,7 +150,7 @@ async def process_schedule_photo(data: SchedulePhotoData) -> Dict[str, Any]:
         }
 
 
-async def call_schedule_agent_analyze_image(data: SchedulePhotoData) -> Dict[str, Any]:
+async def call_schedule_agent_analyze_image(data: SchedulePhotoData) -> dict[str, Any]:
     """
     Call Schedule Agent's analyze_schedule_image tool via MCP.
     """
@@ -119,67 +159,40 @@ async def call_schedule_agent_analyze_image(data: SchedulePhotoData) -> Dict[str
         # TODO: Replace with proper MCP client call
         
         schedule_agent_url = "http://schedule-agent:8000"
-        
-        payload = {
-            "team_id": data.team_id,
-            "file_content": data.file_content,
-            "file_name": data.file_name,
-            "file_size": data.file_size,
-            "mime_type": data.mime_type,
-            "uploaded_at": data.uploaded_at
-        }
-        
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                f"{schedule_agent_url}/tools/analyze_schedule_image",
-                json=payload
-            )
-            
-        if response.status_code == 200:
-            result = response.json()
-            logger.info("Successfully called Schedule Agent for image analysis")
-            return result
-        else:
-            logger.error(f"Schedule Agent call failed: {response.status_code} - {response.text}")
-            return {
-                "success": False,
-                "error": f"HTTP {response.status_code}: {response.text}"
-            }
-            
-    except Exception as e:
-        logger.error(f"Error calling Schedule Agent: {str(e)}")
-        return {
-            "success": False,
-            "error": str(e)
-        }
 
+        # Only the signed URL is forwarded; the image bytes never pass through the agents
+        response = await _post_json(
+            f"{schedule_agent_url}/tools/analyze_schedule_image",
+            {
+                "team_id": data.team_id,
+                "file_url": data.file_url,
+                "file_name": data.file_name,
+                "file_size": data.file_size,
+                "mime_type": data.mime_type,
+                "uploaded_at": data.uploaded_at,
+                "create": True
+            }
+        )
 
-async def call_schedule_agent_create_events(data: Dict[str, Any]) -> Dict[str, Any]:
-    """
-    Call Schedule Agent's create_events tool via MCP.
-    """
-    try:
-        schedule_agent_url = "http://schedule-agent:8000"
-        
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{schedule_agent_url}/tools/create_events",
-                json=data
-            )
-            
-        if response.status_code == 200:
-            result = response.json()
-            logger.info("Successfully called Schedule Agent for event creation")
+        if 200 <= response.status_code < 300:
+            if not response.content:
+                logger.error("Schedule Agent returned an empty response: %s", response.status_code)
+                return {
+                    "success": False,
+                    "error": f"HTTP {response.status_code}: empty response from Schedule Agent"
+                }
+            result = orjson.loads(response.content)
+            logger.debug("Successfully called Schedule Agent for image analysis")
             return result
         else:
-            logger.error(f"Event creation call failed: {response.status_code} - {response.text}")
+            logger.error("Schedule Agent call failed: %s - %s", response.status_code, response.text)
             return {
                 "success": False,
                 "error": f"HTTP {response.status_code}: {response.text}"
             }
             
     except Exception as e:
-        logger.error(f"Error calling Schedule Agent for event creation: {str(e)}")
+        logger.error("Error calling Schedule Agent: %s", e)
         return {
             "success": False,
             "error": str(e)
@@ -187,7 +200,7 @@ async def call_schedule_agent_create_events(data: Dict[str, Any]) -> Dict[str, A
 
 
 @app.tool()
-async def upload_schedule(data: ScheduleData) -> Dict[str, Any]:
+async def upload_schedule(data: ScheduleData) -> dict[str, Any]:
     """
     Upload and parse a team schedule. Delegates to Schedule Agent.
     """
@@ -201,7 +214,7 @@ async def upload_schedule(data: ScheduleData) -> Dict[str, Any]:
 
 
 @app.tool()
-async def send_reminder(data: ReminderData) -> Dict[str, Any]:
+async def send_reminder(data: ReminderData) -> dict[str, Any]:
     """
     Send a reminder to team members. Orchestrates multiple agents.
     """
@@ -215,7 +228,7 @@ async def send_reminder(data: ReminderData) -> Dict[str, Any]:
 
 
 @app.tool()
-async def analyze_attendance(data: AttendanceData) -> Dict[str, Any]:
+async def analyze_attendance(data: AttendanceData) -> dict[str, Any]:
     """
     Analyze attendance patterns. Delegates to Attendance Agent.
     """
@@ -228,26 +241,53 @@ async def analyze_attendance(data: AttendanceData) -> Dict[str, Any]:
     }
 
 
+def _build_asgi_app():
+    """
+    Build the HTTP app, closing the shared client once when the server shuts down.
+    """
+    # Stateless, so a request can land on any uvicorn worker without a pinned session
+    http_app = app.http_app(stateless_http=True)
+    mcp_lifespan = http_app.router.lifespan_context
+
+    @asynccontextmanager
+    async def lifespan(asgi):
+        try:
+            async with mcp_lifespan(asgi) as state:
+                yield state
+        finally:
+            await _client.aclose()
+
+    http_app.router.lifespan_context = lifespan
+    return http_app
+
+
+async def _run_stdio() -> None:
+    """Serve over stdio, closing the shared client when the server exits."""
+    try:
+        await app.run_stdio_async()
+    finally:
+        await _client.aclose()
+
+
+# ASGI app exposed at module level so uvicorn workers can import it
+asgi_app = _build_asgi_app()
 
 
 if __name__ == "__main__":
     # Check if we need to run as web server
-    import os
     if os.getenv("RUN_HTTP", "false").lower() == "true":
         logger.info("Starting as HTTP server using uvicorn")
         import uvicorn
-        # FastMCP should integrate with ASGI
-        try:
-            # Try to get ASGI app from FastMCP
-            asgi_app = getattr(app, 'app', None) or getattr(app, '_app', None)
-            if asgi_app:
-                uvicorn.run(asgi_app, host="0.0.0.0", port=8000)
-            else:
-                logger.error("Could not get ASGI app from FastMCP")
-                app.run()
-        except Exception as e:
-            logger.error(f"Failed to start HTTP server: {e}")
-            app.run()
+
+        uvicorn.run(
+            "main:asgi_app",
+            host="0.0.0.0",
+            port=8000,
+            workers=int(os.getenv("WEB_CONCURRENCY", "4")),
+            loop="uvloop",
+            http="httptools",
+            log_level="warning",
+        )
     else:
         logger.info("Starting with STDIO transport")
-        app.run()
+        asyncio.run(_run_stdio())